@@ -2,11 +2,16 @@
 # Simula transacciones bancarias en tiempo real con patrones de fraude.
 
 import boto3
-import json
-import random
+import gzip
+import numpy as np
+import queue
+import threading
 import time
-from datetime import datetime, timedelta
-import uuid
+from collections import deque
+from aws_kinesis_agg import MAX_BYTES_PER_RECORD
+from aws_kinesis_agg.aggregator import RecordAggregator
+# Generado con protoc desde 02_Lambda_Processor/schema/transaction.proto
+from transaction_pb2 import Transaction
 
 # --- Configuration ---
 # ¡IMPORTANTE! Asegúrate de que este nombre coincida con el creado en AWS CLI.
@@ -15,6 +20,24 @@ AWS_REGION = "us-east-1"
 # Probabilidad base de que una transacción sea catalogada como Fraude (5%)
 BASE_FRAUD_PROBABILITY = 0.05 
 
+# --- Batching Configuration ---
+# Agrupamos los registros en llamadas PutRecords (modelo de colecciones del KPL)
+# para no pagar un round-trip HTTPS completo por cada transacción.
+MAX_BATCH_RECORDS = 500 # Límite de registros por llamada PutRecords
+MAX_BATCH_BYTES = int(4.5 * 1024 * 1024) # Margen bajo el límite de 5 MB por llamada
+MAX_BUFFERED_TIME = 0.1 # Segundos máximos en el buffer (equivalente a RecordMaxBufferedTime)
+MAX_QUEUED_RECORDS = 10_000 # Cola acotada hacia el hilo de envío (equivalente a queueLimit)
+MAX_PUT_RETRIES = 5
+RETRY_BASE_DELAY = 0.1 # Segundos; se duplica en cada reintento (backoff exponencial)
+# Cada registro agregado se comprime con gzip antes de enviarlo: el límite de
+# 1 MB/s por shard cuenta bytes comprimidos. El nivel 1 mantiene el coste de CPU bajo.
+GZIP_MAGIC = b'GZ\x01' # Prefijo que el consumidor usa para detectar la compresión
+GZIP_LEVEL = 1
+# Margen para lo que se añade tras el conteo de tamaño del agregador: el prefijo
+# GZIP_MAGIC, la cabecera/cola de gzip, los ~5 bytes por bloque de 64 KB que
+# deflate añade si los datos no comprimen, y la PartitionKey (hasta 256 bytes).
+AGGREGATE_FRAMING_MARGIN = 1024
+
 # Initialize the Kinesis client
 try:
     # Usar el perfil 'default' configurado en la CLI
@@ -36,97 +59,247 @@ RISKY_AMOUNT_RANGE = (500.00, 3000.00)
 # Coordenadas geográficas
 INITIAL_GEO_LOCATION = {"lat": (34.0, 36.0), "lon": (-118.0, -116.0)} # California (USA)
 DRIFT_GEO_LOCATION = {"lat": (40.5, 41.0), "lon": (-74.0, -73.5)} # New York (USA)
+# Minutos hasta que empieza el escenario de drift
+DRIFT_START_MINUTES = 10
 # IPs y Tarjetas (para simular reglas de Blacklist/Grafos)
 BLACKLIST_IP = "10.10.10.10"
 BLACKLIST_CARD = "4000123456789012"
 
-def generate_transaction(user_id, amount_range, geo_location, is_drift_scenario=False):
-    """Genera un registro de transacción con lógica de fraude."""
-    
-    # 1. Base de la transacción
-    record = {
-        "transactionId": str(uuid.uuid4()),
-        "userId": user_id,
-        "merchantId": random.choice(MERCHANT_IDS),
-        "amount": round(random.uniform(*amount_range), 2),
-        "latitude": round(random.uniform(*geo_location["lat"]), 6),
-        "longitude": round(random.uniform(*geo_location["lon"]), 6),
-        "timestamp": datetime.utcnow().isoformat(),
+# --- Generación vectorizada ---
+# Generamos lotes completos con NumPy en lugar de ~6 llamadas a 'random' por transacción.
+GENERATION_BATCH_SIZE = 500
+rng = np.random.default_rng() # Una sola instancia para todo el proceso
+USER_IDS_ARRAY = np.array(USER_IDS)
+MERCHANT_IDS_ARRAY = np.array(MERCHANT_IDS)
+
+def generate_uuids(size):
+    """Genera 'size' UUID v4 en bloque desde un único buffer de bytes aleatorios."""
+    raw = np.frombuffer(rng.bytes(16 * size), dtype=np.uint8).reshape(size, 16).copy()
+    raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40 # Versión 4
+    raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80 # Variante RFC 4122
+    # Un solo .hex() para todo el lote; sin objetos uuid.UUID ni os.urandom por registro
+    hex_digits = raw.tobytes().hex()
+    return np.array([
+        f"{h[0:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:32]}"
+        for h in (hex_digits[i * 32:(i + 1) * 32] for i in range(size))
+    ])
+
+def generate_batch(size, amount_range, geo_location, is_drift_scenario=False):
+    """Genera un lote de transacciones con lógica de fraude, como un array NumPy por campo."""
+
+    # 1. Base de las transacciones (struct-of-arrays)
+    ip_suffixes = rng.integers(10, 200, size=size, endpoint=True)
+    batch = {
+        "transactionId": generate_uuids(size),
+        "userId": rng.choice(USER_IDS_ARRAY, size=size),
+        "merchantId": rng.choice(MERCHANT_IDS_ARRAY, size=size),
+        "amount": np.round(rng.uniform(*amount_range, size=size), 2),
+        "latitude": np.round(rng.uniform(*geo_location["lat"], size=size), 6),
+        "longitude": np.round(rng.uniform(*geo_location["lon"], size=size), 6),
         # Datos para reglas y grafos
-        "ipAddress": f"192.168.1.{random.randint(10, 200)}",
-        "cardHash": str(random.randint(1000000000000000, 9999999999999999))
+        "ipAddress": np.char.add("192.168.1.", ip_suffixes.astype(str)),
+        "cardHash": rng.integers(1000000000000000, 9999999999999999, size=size, endpoint=True).astype(str)
     }
-    
-    # 2. Lógica de Fraude (Etiqueta "isFraud" para medir el rendimiento del ML)
-    is_fraud = False
-    
+
+    # 2. Lógica de Fraude (Etiqueta "isFraud" para medir el rendimiento del ML), como máscaras booleanas
     # Fraude aleatorio
-    if random.random() < BASE_FRAUD_PROBABILITY:
-        is_fraud = True
-        
+    is_fraud = rng.random(size) < BASE_FRAUD_PROBABILITY
+
     # Patrón de Fraude A: Fraude de alto monto o Blacklist
-    if record["amount"] > 1000.00 or record["cardHash"] == BLACKLIST_CARD:
-        is_fraud = True
-        
+    is_fraud |= (batch["amount"] > 1000.00) | (batch["cardHash"] == BLACKLIST_CARD)
+
     # Patrón de Fraude B (Concept Drift - El Fraude ha cambiado de ubicación/patrón)
     if is_drift_scenario:
         # El fraude en esta fase está en la nueva ubicación (New York) y es de alto riesgo
-        if random.random() < 0.20: # 20% de probabilidad de fraude en la fase Drift
-            is_fraud = True
-            record["ipAddress"] = BLACKLIST_IP # Introduce una IP blacklisteada en el nuevo patrón
+        drift_fraud = rng.random(size) < 0.20 # 20% de probabilidad de fraude en la fase Drift
+        is_fraud |= drift_fraud
+        # Introduce una IP blacklisteada en el nuevo patrón
+        batch["ipAddress"] = np.where(drift_fraud, BLACKLIST_IP, batch["ipAddress"])
+
+    batch["isFraud"] = is_fraud
+
+    return batch
+
+def iter_batch_records(batch):
+    """Convierte el lote en registros (dicts con tipos nativos de Python) solo al serializar."""
+    fields = list(batch.keys())
+    columns = [values.tolist() for values in batch.values()]
+    for values in zip(*columns):
+        yield dict(zip(fields, values))
+
+# Cola entre el bucle generador y el hilo de envío. Si se llena, put() bloquea
+# al generador: backpressure automática cuando Kinesis no da abasto.
+_send_queue = queue.Queue(maxsize=MAX_QUEUED_RECORDS)
+_STOP = object() # Centinela para detener el hilo de envío
+
+# Buffer en memoria de registros pendientes de enviar (solo lo usa el hilo de envío)
+_buffer = deque()
+_buffer_bytes = 0
+_last_flush_time = time.time()
+
+# Agregador KPL: empaqueta muchas transacciones en un único registro de Kinesis
+# (magic 0xF3899AC2 + protobuf AggregatedRecord + MD5). Así el límite de
+# 1000 registros/s por shard deja de ser el cuello de botella con payloads pequeños.
+# Nota: el registro agregado usa la PartitionKey de su primera transacción; con
+# más de un shard, el orden por usuario solo se mantiene dentro de cada agregado.
+_aggregator = RecordAggregator(max_size=MAX_BYTES_PER_RECORD - AGGREGATE_FRAMING_MARGIN)
+
+def _enqueue_aggregated(agg_record):
+    """Comprime un registro agregado completo y lo añade al buffer de PutRecords."""
+    global _buffer_bytes
+
+    partition_key, explicit_hash_key, agg_data = agg_record.get_contents()
+    data = GZIP_MAGIC + gzip.compress(agg_data, compresslevel=GZIP_LEVEL)
+    entry_bytes = len(data) + len(partition_key)
+    # Enviar antes de añadir si el agregado haría superar el límite por llamada
+    # (cada agregado puede acercarse a 1 MB y PutRecords rechaza el lote entero)
+    if _buffer and _buffer_bytes + entry_bytes > MAX_BATCH_BYTES:
+        flush_batch()
+
+    entry = {'Data': data, 'PartitionKey': partition_key}
+    if explicit_hash_key:
+        entry['ExplicitHashKey'] = explicit_hash_key
+    _buffer.append(entry)
+    _buffer_bytes += entry_bytes
+
+def flush_batch():
+    """Envía el buffer con PutRecords y reintenta los registros rechazados con backoff exponencial."""
+    global _buffer_bytes, _last_flush_time
+
+    batch = list(_buffer)
+    _buffer.clear()
+    _buffer_bytes = 0
+    _last_flush_time = time.time()
 
-    record["isFraud"] = is_fraud
-    
-    return record
+    attempt = 0
+    while batch:
+        try:
+            response = kinesis_client.put_records(StreamName=STREAM_NAME, Records=batch)
+        except Exception as e:
+            # Esto imprimirá un error si el stream no existe o si las credenciales fallan
+            print(f"Error al enviar lote a Kinesis: {e}")
+            return False
+
+        if response.get('FailedRecordCount', 0) == 0:
+            return True
+
+        # PutRecords no es atómico: solo reenviamos las entradas con ErrorCode
+        # (normalmente ProvisionedThroughputExceededException).
+        batch = [
+            entry for entry, result in zip(batch, response['Records'])
+            if 'ErrorCode' in result
+        ]
+        if attempt >= MAX_PUT_RETRIES:
+            print(f"Descartados {len(batch)} registros tras {MAX_PUT_RETRIES} reintentos.")
+            return False
+
+        time.sleep(RETRY_BASE_DELAY * (2 ** attempt))
+        attempt += 1
+
+    return True
 
 def send_to_kinesis(transaction_record):
-    """Envía el registro JSON al stream Kinesis especificado."""
-    try:
-        kinesis_client.put_record(
-            StreamName=STREAM_NAME,
-            Data=json.dumps(transaction_record).encode('utf-8'), # Codificar a bytes
-            PartitionKey=transaction_record["userId"] # Clave para asegurar el orden por usuario
-        )
-        return True
-    except Exception as e:
-        # Esto imprimirá un error si el stream no existe o si las credenciales fallan
-        print(f"Error al enviar registro a Kinesis: {e}")
-        return False
+    """Serializa el registro Protobuf y lo encola para el hilo de envío."""
+    data = Transaction(**transaction_record).SerializeToString() # Codificar a bytes
+    # Clave para asegurar el orden por usuario
+    _send_queue.put((transaction_record["userId"], data), block=True)
+    return True
+
+def producer_loop():
+    """Hilo de envío: drena la cola hacia el agregador y envía lotes PutRecords."""
+    global _last_flush_time
+
+    stopping = False
+    while not stopping:
+        timeout = max(0.0, _last_flush_time + MAX_BUFFERED_TIME - time.time())
+        try:
+            item = _send_queue.get(timeout=timeout)
+            if item is _STOP:
+                stopping = True
+            else:
+                agg_record = _aggregator.add_user_record(*item)
+                if agg_record:
+                    # El agregado anterior se llenó (~1 MB): pasa al buffer de PutRecords
+                    _enqueue_aggregated(agg_record)
+        except queue.Empty:
+            pass
+        except Exception as e:
+            # Si el hilo muere, la cola se llena y el generador queda bloqueado en put()
+            print(f"Error al agregar la transacción de {item[0]}: {e}")
+
+        linger_expired = time.time() - _last_flush_time >= MAX_BUFFERED_TIME
+        try:
+            if linger_expired or stopping:
+                # Cerrar el agregado en curso para no retener transacciones más del linger
+                pending = _aggregator.clear_and_get()
+                if pending:
+                    _enqueue_aggregated(pending)
+
+            if _buffer and (len(_buffer) >= MAX_BATCH_RECORDS
+                    or _buffer_bytes >= MAX_BATCH_BYTES
+                    or linger_expired or stopping):
+                flush_batch()
+            elif linger_expired:
+                # Nada que enviar: reiniciar el temporizador para no girar en vacío
+                _last_flush_time = time.time()
+        except Exception as e:
+            print(f"Error al preparar el lote para Kinesis: {e}")
+            # Reiniciar el temporizador para no reintentar en bucle sin esperar
+            _last_flush_time = time.time()
 
 def main():
     """Bucle principal para generar y enviar transacciones."""
     start_time = time.time()
     print(f"Comenzando el envío al stream '{STREAM_NAME}'...")
 
-    while True:
-        elapsed_time_minutes = (time.time() - start_time) / 60
-        
-        # --- Lógica de Drift (Cambio de patrón después de 10 minutos) ---
-        is_drift = elapsed_time_minutes > 10
-
-        if is_drift:
-            # Fase de Drift: Patrones cambian a una nueva ubicación/monto
-            current_user = random.choice(USER_IDS)
-            current_amount_range = RISKY_AMOUNT_RANGE
-            current_geo = DRIFT_GEO_LOCATION
-            drift_message = f" [DRIFT: {elapsed_time_minutes:.1f}m]"
-        else:
-            # Fase Normal: Operaciones estándar
-            current_user = random.choice(USER_IDS)
-            current_amount_range = NORMAL_AMOUNT_RANGE
-            current_geo = INITIAL_GEO_LOCATION
-            drift_message = ""
-
-        # Generar y enviar la transacción
-        transaction = generate_transaction(current_user, current_amount_range, current_geo, is_drift)
-
-        if send_to_kinesis(transaction):
-            status = "FRAUDE SIMULADO" if transaction['isFraud'] else "LEGÍTIMA"
-            print(f"Enviado {status} | User: {transaction['userId']} | Monto: {transaction['amount']} | Geo: {current_geo['lat'][0]:.1f}{drift_message}")
-        
-        # Control de la tasa: ~4 transacciones por segundo (240 por minuto)
-        # Ajusta el 'sleep' si necesitas más de 1000 tx/min. Para Free Tier, esta tasa es segura.
-        time.sleep(random.uniform(0.1, 0.3)) 
+    # La E/S de red (PutRecords) corre en segundo plano y se solapa con la generación
+    producer = threading.Thread(target=producer_loop, daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            elapsed_time_minutes = (time.time() - start_time) / 60
+            
+            # --- Lógica de Drift (Cambio de patrón después de 10 minutos) ---
+            is_drift = elapsed_time_minutes > DRIFT_START_MINUTES
+
+            if is_drift:
+                # Fase de Drift: Patrones cambian a una nueva ubicación/monto
+                current_amount_range = RISKY_AMOUNT_RANGE
+                current_geo = DRIFT_GEO_LOCATION
+            else:
+                # Fase Normal: Operaciones estándar
+                current_amount_range = NORMAL_AMOUNT_RANGE
+                current_geo = INITIAL_GEO_LOCATION
+
+            # Generar un lote de transacciones de una vez
+            batch = generate_batch(GENERATION_BATCH_SIZE, current_amount_range, current_geo, is_drift)
+            # Control de la tasa: ~4 transacciones por segundo (240 por minuto)
+            # Ajusta el 'sleep' si necesitas más de 1000 tx/min. Para Free Tier, esta tasa es segura.
+            delays = rng.uniform(0.1, 0.3, size=GENERATION_BATCH_SIZE)
+
+            for transaction, delay in zip(iter_batch_records(batch), delays):
+                # Un lote dura ~100 s al ritmo de envío: si la fase cambia a mitad
+                # de lote, se descarta el resto y se genera uno nuevo con la fase actual.
+                elapsed_time_minutes = (time.time() - start_time) / 60
+                if (elapsed_time_minutes > DRIFT_START_MINUTES) != is_drift:
+                    break
+                drift_message = f" [DRIFT: {elapsed_time_minutes:.1f}m]" if is_drift else ""
+
+                # Epoch en milisegundos: más compacto que el ISO 8601 en el cable.
+                # Se asigna al enviar porque el lote se genera por adelantado.
+                # La conversión a ISO se hace solo en el camino Firehose -> S3.
+                transaction["timestamp"] = int(time.time() * 1000)
+
+                if send_to_kinesis(transaction):
+                    status = "FRAUDE SIMULADO" if transaction['isFraud'] else "LEGÍTIMA"
+                    print(f"Enviado {status} | User: {transaction['userId']} | Monto: {transaction['amount']} | Geo: {current_geo['lat'][0]:.1f}{drift_message}")
+
+                time.sleep(delay)
+    finally:
+        # El hilo de envío manda lo que quede en la cola, el agregador y el buffer antes de salir
+        _send_queue.put(_STOP)
+        producer.join()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
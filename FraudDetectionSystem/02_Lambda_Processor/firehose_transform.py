@@ -0,0 +1,44 @@
+# firehose_transform.py
+# Firehose data-transformation Lambda: converts the Protobuf records on the
+# Kinesis stream back into newline-delimited JSON, which Firehose then converts
+# to Parquet (Glue table schema) for the S3 data lake / Athena.
+
+import base64
+import orjson
+
+from schema.codec import decode_transaction, epoch_ms_to_iso, iter_user_records
+
+def transform_record(data):
+    """Expands one Kinesis record into newline-delimited JSON transactions."""
+    # Firehose cannot de-aggregate the gzip-compressed KPL records itself, so a
+    # single Firehose record may carry many transactions.
+    lines = []
+    for user_record in iter_user_records(data):
+        transaction = decode_transaction(user_record)
+        # The stream carries epoch milliseconds; Athena queries expect ISO 8601.
+        transaction['timestamp'] = epoch_ms_to_iso(transaction['timestamp'])
+        # orjson writes UTF-8 bytes directly, so no str round trip before base64
+        lines.append(orjson.dumps(transaction, option=orjson.OPT_APPEND_NEWLINE))
+    return b"".join(lines)
+
+def lambda_handler(event, context):
+    """Main handler, invoked by Kinesis Data Firehose with a batch of records."""
+    output = []
+    for record in event['records']:
+        try:
+            data = transform_record(base64.b64decode(record['data']))
+            output.append({
+                'recordId': record['recordId'],
+                'result': 'Ok',
+                'data': base64.b64encode(data).decode('utf-8')
+            })
+        except Exception as e:
+            print(f"Error transforming record {record['recordId']}: {e}")
+            # Firehose delivers failed records to the error output prefix
+            output.append({
+                'recordId': record['recordId'],
+                'result': 'ProcessingFailed',
+                'data': record['data']
+            })
+
+    return {'records': output}
@@ -1,12 +1,122 @@
 # graph_logic/graph_queries.py
 # Module to handle querying DynamoDB for graph-like relationships.
 
+import os
+import threading
+import time
+from functools import lru_cache
+
 import boto3
+from botocore.config import Config
+from pybloomfilter import BloomFilter
 
 # --- Configuration ---
 USER_GRAPH_TABLE = "UserGraphTable"
-dynamodb_client = boto3.resource('dynamodb')
-table = dynamodb_client.Table(USER_GRAPH_TABLE)
+# Query results are cached in the warm container for this long
+CACHE_TTL_SECONDS = 300
+CACHE_MAX_NODES = 50_000
+# The Bloom filter of nodes linked to fraud is rebuilt (full table scan, in a
+# background thread) this often. Nodes linked to fraud after a snapshot are false
+# negatives until the next rebuild lands: about this long plus the scan time.
+FRAUD_FILTER_REFRESH_SECONDS = int(os.environ.get("FRAUD_FILTER_REFRESH_SECONDS", "900"))
+FRAUD_FILTER_CAPACITY = 10_000_000
+FRAUD_FILTER_ERROR_RATE = 1e-4
+
+# Low-level client: raw AttributeValue dicts, no per-call parameter validation
+dynamodb_client = boto3.client('dynamodb', config=Config(
+    parameter_validation=False,
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={'max_attempts': 2, 'mode': 'standard'}
+))
+
+_fraud_filter = None
+_fraud_filter_loaded_at = 0.0
+_fraud_filter_thread = None
+
+def load_fraud_filter():
+    """
+    Scans the UserGraphTable for nodes with at least one fraudulent related node.
+
+    Returns:
+        BloomFilter: The nodeIds found, as of the scan. A negative test skips the
+        DynamoDB query, so most lookups for clean nodes never reach DynamoDB; it is
+        only exact for links that existed when the scan ran (see
+        FRAUD_FILTER_REFRESH_SECONDS for the staleness window).
+    """
+    fraud_filter = BloomFilter(FRAUD_FILTER_CAPACITY, FRAUD_FILTER_ERROR_RATE)
+    scan_kwargs = {
+        'TableName': USER_GRAPH_TABLE,
+        'FilterExpression': 'relatedNodeProperties.isFraudulent = :fraudulent',
+        'ExpressionAttributeValues': {':fraudulent': {'BOOL': True}},
+        'ProjectionExpression': 'nodeId'
+    }
+    while True:
+        response = dynamodb_client.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            fraud_filter.add(item['nodeId']['S'])
+        if 'LastEvaluatedKey' not in response:
+            return fraud_filter
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def _rebuild_fraud_filter():
+    """Background thread body: scans the table and swaps in the new filter."""
+    global _fraud_filter
+    try:
+        _fraud_filter = load_fraud_filter()
+        print("Loaded fraud-link Bloom filter from UserGraphTable.")
+    except Exception as e:
+        print(f"Error loading fraud-link Bloom filter: {e}")
+        # Without a filter every lookup falls back to querying DynamoDB
+        _fraud_filter = None
+
+def get_fraud_filter():
+    """
+    Returns the current Bloom filter (None until the first scan completes).
+
+    When it is older than the refresh interval a rebuild starts in a background
+    thread, and the previous filter keeps being served, so no invocation waits
+    for the full table scan. (Lambda freezes the thread between invocations, so
+    the scan advances while invocations run.)
+    """
+    global _fraud_filter_loaded_at, _fraud_filter_thread
+
+    rebuilding = _fraud_filter_thread is not None and _fraud_filter_thread.is_alive()
+    if not rebuilding and time.time() - _fraud_filter_loaded_at >= FRAUD_FILTER_REFRESH_SECONDS:
+        # Set first so a failing scan is not retried on every record
+        _fraud_filter_loaded_at = time.time()
+        _fraud_filter_thread = threading.Thread(target=_rebuild_fraud_filter, daemon=True)
+        _fraud_filter_thread.start()
+    return _fraud_filter
+
+@lru_cache(maxsize=CACHE_MAX_NODES)
+def _find_fraudulent_link(node_id, ttl_bucket):
+    """
+    Queries the UserGraphTable for a fraudulent node related to node_id.
+
+    ttl_bucket is int(time.time() // CACHE_TTL_SECONDS); it is part of the cache
+    key only so that cached results expire after CACHE_TTL_SECONDS.
+
+    Returns:
+        str: The relatedNodeId of the first fraudulent node found, or None.
+    """
+    # This is a simplified query. A real implementation might involve
+    # multi-level lookups or more complex graph patterns.
+    response = dynamodb_client.query(
+        TableName=USER_GRAPH_TABLE,
+        KeyConditionExpression='nodeId = :node_id',
+        ExpressionAttributeValues={':node_id': {'S': node_id}}
+    )
+
+    for item in response.get('Items', []):
+        # Check if any related node is marked as fraudulent
+        related_properties = item.get('relatedNodeProperties', {}).get('M', {})
+        if related_properties.get('isFraudulent', {}).get('BOOL', False):
+            return item['relatedNodeId']['S']
+    return None
+
+# Start the first scan at init; lookups query DynamoDB until it completes
+get_fraud_filter()
 
 def is_linked_to_fraud(node_id, node_type="user"):
     """
@@ -22,19 +132,16 @@ def is_linked_to_fraud(node_id, node_type="user"):
     """
     print(f"Graph check for {node_type}: {node_id}")
     try:
-        # This is a simplified query. A real implementation might involve
-        # multi-level lookups or more complex graph patterns.
-        response = table.query(
-            KeyConditionExpression=boto3.dynamodb.conditions.Key('nodeId').eq(node_id)
-        )
-
-        items = response.get('Items', [])
-
-        for item in items:
-            # Check if any related node is marked as fraudulent
-            if item.get('relatedNodeProperties', {}).get('isFraudulent', False):
-                print(f"ALERT: Node {node_id} is connected to fraudulent node {item['relatedNodeId']}.")
-                return True
+        fraud_filter = get_fraud_filter()
+        if fraud_filter is not None and node_id not in fraud_filter:
+            print(f"No direct fraudulent links found for {node_id}.")
+            return False
+
+        # Possible positive (or no filter): confirm against DynamoDB, cached per TTL window
+        related_node_id = _find_fraudulent_link(node_id, int(time.time() // CACHE_TTL_SECONDS))
+        if related_node_id is not None:
+            print(f"ALERT: Node {node_id} is connected to fraudulent node {related_node_id}.")
+            return True
 
         print(f"No direct fraudulent links found for {node_id}.")
         return False
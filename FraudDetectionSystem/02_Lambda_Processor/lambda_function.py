@@ -1,37 +1,76 @@
 # lambda_function.py
 # The core processing logic for the real-time fraud detection system.
 
-import json
 import base64
-import random
-import joblib
+import orjson
 import boto3
+import numpy as np
+import xgboost as xgb
 import os
-from datetime import datetime
-from decimal import Decimal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from river.drift import ADWIN
 
 # (Best practice) Use a separate module for graph logic
 from graph_logic.graph_queries import is_linked_to_fraud
+from feature_logic.feature_kernels import compute_features
+from schema.codec import decode_transaction, epoch_ms_to_iso, iter_user_records
 
 # --- Environment & AWS Clients ---
 # These would be set in the Lambda environment variables
 USER_PROFILE_TABLE = os.environ.get("USER_PROFILE_TABLE", "UserProfileTable")
-CHAMPION_MODEL_PATH = "champion/model_v1.joblib"
-CHALLENGER_MODEL_PATH = "challenger/model_v2.joblib"
+# XGBoost's native UBJSON format loads much faster than unpickling (see 03_ML_Model/export_models.py)
+CHAMPION_MODEL_PATH = "champion/model_v1.ubj"
+CHALLENGER_MODEL_PATH = "challenger/model_v2.ubj"
 SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN", "arn:aws:sns:us-east-1:ACCOUNT_ID:fraud-alerts-topic")
 SQS_QUEUE_URL = os.environ.get("SQS_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/ACCOUNT_ID/fraud-cases-queue")
+# DynamoDB batch limit: 100 keys per BatchGetItem
+BATCH_GET_MAX_KEYS = 100
+BATCH_MAX_RETRIES = 5
+# Profile updates are I/O-bound UpdateItem calls, so they are issued concurrently
+# (kept below the client's max_pool_connections)
+PROFILE_UPDATE_WORKERS = 32
+# A/B traffic share of the champion model, before and after a confidence drift
+CHAMPION_TRAFFIC_SHARE = 0.90
+DRIFT_CHAMPION_TRAFFIC_SHARE = 0.50
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "FraudDetection")
 
 # Initialize clients
-dynamodb = boto3.resource('dynamodb')
+# The hot path uses the low-level DynamoDB client with pre-encoded AttributeValue
+# dicts: no Table resource (TypeSerializer/Deserializer) and no client-side
+# parameter validation on every call.
+DYNAMODB_CONFIG = Config(
+    parameter_validation=False,
+    tcp_keepalive=True,
+    max_pool_connections=50,
+    retries={'max_attempts': 2, 'mode': 'standard'}
+)
+ddb = boto3.client('dynamodb', config=DYNAMODB_CONFIG)
 sns = boto3.client('sns')
 sqs = boto3.client('sqs')
-user_profile_table = dynamodb.Table(USER_PROFILE_TABLE)
+cloudwatch = boto3.client('cloudwatch')
+
+# Random generator for the A/B traffic split, reused across invocations
+ab_rng = np.random.default_rng()
+champion_traffic_share = CHAMPION_TRAFFIC_SHARE
+
+# --- Drift Monitoring ---
+# ADWIN over the champion's confidence scores. Module scope, so the warm container
+# keeps its state across invocations; it only retains O(log W) buckets.
+drift_detector = ADWIN(delta=0.002)
 
 # --- Model Loading ---
+def load_model(path):
+    """Loads an XGBClassifier saved with save_model() (no unpickling on cold start)."""
+    model = xgb.XGBClassifier()
+    model.load_model(path)
+    return model
+
 # Load models into memory outside the handler for reuse across invocations (Lambda optimization)
 try:
-    champion_model = joblib.load(CHAMPION_MODEL_PATH)
-    challenger_model = joblib.load(CHALLENGER_MODEL_PATH)
+    champion_model = load_model(CHAMPION_MODEL_PATH)
+    challenger_model = load_model(CHALLENGER_MODEL_PATH)
     print("Successfully loaded Champion and Challenger models.")
 except Exception as e:
     print(f"FATAL: Could not load models. {e}")
@@ -39,76 +78,247 @@ except Exception as e:
     champion_model = None
     challenger_model = None
 
-def get_user_profile(user_id):
-    """Fetches the user's profile from DynamoDB."""
+def get_user_profiles(user_ids):
+    """
+    Fetches the profiles of a set of users from DynamoDB with BatchGetItem.
+
+    Returns:
+        tuple: (profiles, unresolved_user_ids)
+            profiles: userId -> raw DynamoDB item (AttributeValue dicts, e.g. {'N': '34.05'}).
+            unresolved_user_ids: users whose fetch failed or was given up on. Their
+            profile is unknown, which is not the same as a user with no profile.
+    """
+    user_ids = list(user_ids)
+    profiles = {}
+    unresolved_user_ids = set()
+    for start in range(0, len(user_ids), BATCH_GET_MAX_KEYS):
+        chunk = user_ids[start:start + BATCH_GET_MAX_KEYS]
+        request = {USER_PROFILE_TABLE: {'Keys': [{'userId': {'S': user_id}} for user_id in chunk]}}
+        try:
+            for attempt in range(BATCH_MAX_RETRIES):
+                response = ddb.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(USER_PROFILE_TABLE, []):
+                    profiles[item['userId']['S']] = item
+                # Throttled keys are returned in UnprocessedKeys and must be retried
+                request = response.get('UnprocessedKeys')
+                if not request:
+                    break
+                time.sleep(0.05 * (2 ** attempt))
+            else:
+                unprocessed_keys = request[USER_PROFILE_TABLE]['Keys']
+                print(f"Gave up on {len(unprocessed_keys)} unprocessed profile keys.")
+                unresolved_user_ids.update(key['userId']['S'] for key in unprocessed_keys)
+        except Exception as e:
+            print(f"Error fetching profiles for {len(chunk)} users: {e}")
+            unresolved_user_ids.update(user_id for user_id in chunk if user_id not in profiles)
+    return profiles, unresolved_user_ids
+
+def update_user_profile(user_id, attributes):
+    """Sets the given attributes (AttributeValue dicts) on one user profile with UpdateItem."""
     try:
-        response = user_profile_table.get_item(Key={'userId': user_id})
-        return response.get('Item', {})
+        # SET only touches these attributes: everything else on the item (and any
+        # attribute another writer changes meanwhile) is left as is.
+        names, values, assignments = {}, {}, []
+        for n, (name, value) in enumerate(attributes.items()):
+            names[f"#a{n}"] = name
+            values[f":v{n}"] = value
+            assignments.append(f"#a{n} = :v{n}")
+        ddb.update_item(
+            TableName=USER_PROFILE_TABLE,
+            Key={'userId': {'S': user_id}},
+            UpdateExpression="SET " + ", ".join(assignments),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
     except Exception as e:
-        print(f"Error fetching profile for user {user_id}: {e}")
-        return {}
-
-def feature_engineering(transaction, user_profile):
-    """Creates model features from raw transaction data and user profile."""
-    # Time-based features
-    txn_time = datetime.fromisoformat(transaction['timestamp'])
-    transaction['hour_of_day'] = txn_time.hour
-    transaction['day_of_week'] = txn_time.weekday()
-
-    # User history features
-    transaction['transaction_count_30min'] = user_profile.get('transaction_count_30min', 0)
-
-    # Geospatial anomaly (distance from last known location)
-    last_lat = user_profile.get('last_latitude')
-    last_lon = user_profile.get('last_longitude')
-    if last_lat and last_lon:
-        # Simple distance calculation (not geographically precise but good for a model)
-        geo_distance = ((transaction['latitude'] - last_lat)**2 + (transaction['longitude'] - last_lon)**2)**0.5
-        transaction['geo_distance_anomaly'] = geo_distance
-    else:
-        transaction['geo_distance_anomaly'] = 0
-
-    return transaction
-
-def make_prediction(features_df):
-    """Performs A/B testing to get a model prediction."""
-    if random.random() < 0.90: # 90% traffic to champion
-        model = champion_model
-        model_version = "v1_champion"
-    else: # 10% to challenger
-        model = challenger_model
-        model_version = "v2_challenger"
-
-    prediction_proba = model.predict_proba(features_df)[:, 1][0]
+        print(f"Error updating profile of {user_id}: {e}")
+
+def save_user_profiles(updates_by_user):
+    """
+    Applies the coalesced profile updates (userId -> attributes to set), one
+    UpdateItem per user, sent concurrently.
+
+    BatchWriteItem only supports whole-item puts, which would overwrite the
+    attributes not read in this batch, so partial updates use UpdateItem.
+    """
+    with ThreadPoolExecutor(max_workers=min(PROFILE_UPDATE_WORKERS, len(updates_by_user))) as executor:
+        list(executor.map(update_user_profile, updates_by_user.keys(), updates_by_user.values()))
+
+def feature_engineering(transactions, user_profiles):
+    """
+    Creates model features for a whole batch of transactions and their user profiles.
+
+    Returns:
+        tuple: (features matrix with one row per transaction, geo_distance array)
+    """
+    n = len(transactions)
+    amount = np.fromiter((t['amount'] for t in transactions), dtype=np.float64, count=n)
+    lat = np.fromiter((t['latitude'] for t in transactions), dtype=np.float64, count=n)
+    lon = np.fromiter((t['longitude'] for t in transactions), dtype=np.float64, count=n)
+    ts_epoch_ms = np.fromiter((t['timestamp'] for t in transactions), dtype=np.int64, count=n)
+
+    # User history features (last known location)
+    last_lat = np.zeros(n)
+    last_lon = np.zeros(n)
+    has_last_location = np.zeros(n, dtype=np.bool_)
+    for i, profile in enumerate(user_profiles):
+        if 'last_latitude' in profile and 'last_longitude' in profile:
+            try:
+                last_lat[i] = float(profile['last_latitude']['N'])
+                last_lon[i] = float(profile['last_longitude']['N'])
+                has_last_location[i] = True
+            except (KeyError, TypeError, ValueError) as e:
+                # A malformed profile must not fail the whole batch; score without history
+                print(f"Ignoring malformed last location in profile of {transactions[i]['userId']}: {e}")
+
+    return compute_features(amount, lat, lon, ts_epoch_ms, last_lat, last_lon, has_last_location)
+
+def make_prediction(features_matrix):
+    """
+    Performs A/B testing to get model predictions for a whole batch.
+
+    Each model's predict_proba is called once on its share of the rows instead of
+    once per record.
+
+    Returns:
+        tuple: (is_fraud, prediction_proba, model_version) arrays, one entry per row.
+    """
+    n = features_matrix.shape[0]
+    # 90% traffic to champion, 10% to challenger (50/50 once drift is detected)
+    champion_mask = ab_rng.random(n) < champion_traffic_share
+
+    prediction_proba = np.empty(n)
+    if champion_mask.any():
+        prediction_proba[champion_mask] = champion_model.predict_proba(features_matrix[champion_mask])[:, 1]
+    if not champion_mask.all():
+        prediction_proba[~champion_mask] = challenger_model.predict_proba(features_matrix[~champion_mask])[:, 1]
+
+    model_version = np.where(champion_mask, "v1_champion", "v2_challenger")
     is_fraud = prediction_proba > 0.8 # Decision threshold
 
     return is_fraud, prediction_proba, model_version
 
+def monitor_drift(confidences):
+    """
+    Feeds the champion's confidence scores to ADWIN. On a detected change it
+    publishes a CloudWatch metric and shifts the A/B split to 50/50 so the
+    challenger gets more traffic.
+    """
+    global champion_traffic_share
+
+    drift_count = 0
+    for confidence in confidences:
+        drift_detector.update(float(confidence))
+        if drift_detector.drift_detected:
+            drift_count += 1
+
+    if not drift_count:
+        return
+
+    print(f"ALERT: ADWIN detected drift in champion confidence (window: {drift_detector.width}). "
+          f"Shifting A/B split to {DRIFT_CHAMPION_TRAFFIC_SHARE:.0%} champion.")
+    champion_traffic_share = DRIFT_CHAMPION_TRAFFIC_SHARE
+    try:
+        cloudwatch.put_metric_data(
+            Namespace=METRICS_NAMESPACE,
+            MetricData=[{'MetricName': 'ModelConfidenceDrift', 'Value': drift_count, 'Unit': 'Count'}]
+        )
+    except Exception as e:
+        print(f"Error publishing drift metric: {e}")
+
+def score_transactions(transactions, user_profiles):
+    """
+    Runs the batch stages (features, A/B inference, drift monitoring) over a batch.
+
+    Returns:
+        tuple: (features_matrix, geo_distance, is_fraud, prediction_proba, model_version)
+    """
+    features_matrix, geo_distance = feature_engineering(transactions, user_profiles)
+    is_fraud, prediction_proba, model_version = make_prediction(features_matrix)
+    monitor_drift(prediction_proba[model_version == "v1_champion"])
+    return features_matrix, geo_distance, is_fraud, prediction_proba, model_version
+
+def score_transactions_per_record(transactions, user_profiles):
+    """
+    Fallback for a batch that failed to score: scores each transaction on its own
+    so that one bad record is skipped instead of failing (and blocking) the shard.
+
+    Returns:
+        tuple: (scored transactions, their user profiles, score arrays as in score_transactions)
+    """
+    scored_transactions, scored_profiles, score_rows = [], [], []
+    for payload, profile in zip(transactions, user_profiles):
+        try:
+            score_rows.append(score_transactions([payload], [profile]))
+            scored_transactions.append(payload)
+            scored_profiles.append(profile)
+        except Exception as e:
+            print(f"Error scoring transaction {payload.get('transactionId')}: {e}")
+            # Continue to next record
+
+    if not score_rows:
+        return [], [], None
+    return scored_transactions, scored_profiles, tuple(np.concatenate(column) for column in zip(*score_rows))
+
+def iter_transaction_payloads(kinesis_records):
+    """Yields the serialized transactions carried by a batch of Kinesis records."""
+    for record in kinesis_records:
+        try:
+            # The producer packs many transactions into one gzip-compressed,
+            # KPL-aggregated Kinesis record; expand them here.
+            yield from iter_user_records(base64.b64decode(record['kinesis']['data']))
+        except Exception as e:
+            print(f"Error unpacking Kinesis record {record['kinesis'].get('sequenceNumber')}: {e}")
+            # Continue to next record
+
 def lambda_handler(event, context):
     """Main Lambda handler triggered by Kinesis."""
     if not champion_model or not challenger_model:
         print("Models are not loaded. Aborting.")
         return {'statusCode': 500, 'body': 'Internal Server Error: Models failed to load.'}
 
-    for record in event['Records']:
+    # Decode the whole batch first so features are computed in a single kernel call
+    transactions = []
+    for data in iter_transaction_payloads(event['Records']):
         try:
-            payload_b64 = record['kinesis']['data']
-            payload = json.loads(base64.b64decode(payload_b64))
-            print(f"Processing transaction: {payload['transactionId']}")
+            transactions.append(decode_transaction(data))
+        except Exception as e:
+            print(f"Error decoding transaction: {e}")
+            # Continue to next record
+
+    if not transactions:
+        return {'statusCode': 200, 'body': 'Processing complete.'}
+
+    # 1. User profiles for feature engineering
+    # One BatchGetItem per 100 distinct users instead of one GetItem per record
+    profiles_by_user, unresolved_user_ids = get_user_profiles({payload['userId'] for payload in transactions})
+    user_profiles = [profiles_by_user.get(payload['userId'], {}) for payload in transactions]
+    if unresolved_user_ids:
+        print(f"Scoring {len(unresolved_user_ids)} users without profile history: profile fetch failed.")
+
+    # 2. Feature Engineering and ML Model Inference (A/B Test), vectorized over the batch
+    try:
+        scores = score_transactions(transactions, user_profiles)
+    except Exception as e:
+        print(f"Error scoring batch of {len(transactions)} transactions, retrying per record: {e}")
+        transactions, user_profiles, scores = score_transactions_per_record(transactions, user_profiles)
+        if scores is None:
+            return {'statusCode': 200, 'body': 'Processing complete.'}
+    features_matrix, geo_distance, ml_fraud, ml_confidence, ml_model_version = scores
 
-            # 1. Feature Engineering
-            user_profile = get_user_profile(payload['userId'])
-            features = feature_engineering(payload, user_profile)
+    # Latest profile attributes per legitimate user in this batch (last one wins)
+    updated_profiles = {}
 
-            # 2. Graph-based Fraud Check
+    for i, payload in enumerate(transactions):
+        try:
+            print(f"Processing transaction: {payload['transactionId']}")
+
+            # 3. Graph-based Fraud Check
             is_graph_fraud = is_linked_to_fraud(payload['userId'])
 
-            # 3. ML Model Inference (A/B Test)
-            model_features = [
-                features['amount'], features['latitude'], features['longitude'],
-                features['hour_of_day'], features['day_of_week']
-            ]
-            is_ml_fraud, confidence, model_version = make_prediction([model_features])
+            is_ml_fraud = bool(ml_fraud[i])
+            confidence = ml_confidence[i]
+            model_version = ml_model_version[i]
 
             # 4. Final Decision Logic
             # Combine signals: if either graph or ML model flags it, it's fraud.
@@ -119,10 +329,17 @@ def lambda_handler(event, context):
 
             if final_decision_is_fraud:
                 # 5a. Fraud Actions
+                # Attach the engineered features for the investigation workflow
+                payload['hour_of_day'] = int(features_matrix[i, 3])
+                payload['day_of_week'] = int(features_matrix[i, 4])
+                payload['transaction_count_30min'] = int(user_profiles[i].get('transaction_count_30min', {}).get('N', 0))
+                payload['geo_distance_anomaly'] = float(geo_distance[i])
+
                 # Send to SQS for Step Functions workflow
                 sqs.send_message(
                     QueueUrl=SQS_QUEUE_URL,
-                    MessageBody=json.dumps(payload, default=str)
+                    # orjson serializes to bytes (several times faster than json); SQS wants str
+                    MessageBody=orjson.dumps(payload, default=str, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
                 )
                 # Send alert to SNS
                 sns.publish(
@@ -132,19 +349,23 @@ def lambda_handler(event, context):
                 )
             else:
                 # 5b. Legitimate Actions
-                # Update user profile (this would be more complex in reality)
-                user_profile_table.update_item(
-                    Key={'userId': payload['userId']},
-                    UpdateExpression="SET last_latitude = :lat, last_longitude = :lon, last_transaction_time = :ts",
-                    ExpressionAttributeValues={
-                        ':lat': Decimal(str(payload['latitude'])),
-                        ':lon': Decimal(str(payload['longitude'])),
-                        ':ts': payload['timestamp']
-                    }
-                )
+                # Update user profile (this would be more complex in reality).
+                # Coalesced per user (last one wins) and written once after the loop.
+                # A partial update, so it is safe even if this user's profile fetch failed.
+                updated_profiles[payload['userId']] = {
+                    # DynamoDB numbers go over the wire as strings; format them directly
+                    # (6 decimals, the precision the generator emits) with no Decimal step
+                    'last_latitude': {'N': f"{payload['latitude']:.6f}"},
+                    'last_longitude': {'N': f"{payload['longitude']:.6f}"},
+                    'last_transaction_time': {'S': epoch_ms_to_iso(payload['timestamp'])}
+                }
 
         except Exception as e:
             print(f"Error processing record: {e}")
             # Continue to next record
 
+    # 6. Persist the coalesced profile updates
+    if updated_profiles:
+        save_user_profiles(updated_profiles)
+
     return {'statusCode': 200, 'body': 'Processing complete.'}
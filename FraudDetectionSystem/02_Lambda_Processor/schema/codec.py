@@ -0,0 +1,80 @@
+# schema/codec.py
+# Helpers to decode the Protobuf transactions carried on the Kinesis stream.
+
+import gzip
+import hashlib
+from datetime import datetime
+
+# KPL aggregated record: MAGIC + AggregatedRecord protobuf + MD5 (DIGEST_SIZE) of the protobuf
+from aws_kinesis_agg import MAGIC as KPL_MAGIC, DIGEST_SIZE as KPL_DIGEST_SIZE
+# The library's generated messages_pb2 imports config_pb2 as a top-level module,
+# which only resolves once the deaggregator has put the package dir on sys.path;
+# take messages_pb2 from the deaggregator so that dependency is explicit.
+from aws_kinesis_agg.deaggregator import messages_pb2
+from schema.transaction_pb2 import Transaction
+
+# Framing written by the producer: b'GZ\x01' + gzip(KPL aggregated record)
+GZIP_MAGIC = b'GZ\x01'
+
+# [epoch second, ISO string] of the last formatted timestamp. Records in a batch
+# share the same few seconds, so strftime-style formatting runs once per second.
+_iso_second_cache = [None, ""]
+
+# Resolved once at import time instead of on every record
+TRANSACTION_FIELDS = [field.name for field in Transaction.DESCRIPTOR.fields]
+
+def decode_transaction(data):
+    """
+    Parses a serialized Transaction message into a plain dict.
+
+    Args:
+        data (bytes): The raw (already base64-decoded) Kinesis record data.
+
+    Returns:
+        dict: The transaction, with proto3 default values included (e.g. isFraud=False).
+    """
+    txn = Transaction()
+    txn.ParseFromString(data)
+    return {name: getattr(txn, name) for name in TRANSACTION_FIELDS}
+
+def iter_user_records(data):
+    """
+    Unwraps one Kinesis record into the transactions it carries.
+
+    The producer gzip-compresses KPL aggregated records, so the KPL magic is
+    only visible after decompression; plain records are yielded unchanged.
+
+    Args:
+        data (bytes): The raw (already base64-decoded) Kinesis record data.
+
+    Yields:
+        bytes: One serialized Transaction per user record.
+    """
+    if data.startswith(GZIP_MAGIC):
+        data = gzip.decompress(data[len(GZIP_MAGIC):])
+
+    if data.startswith(KPL_MAGIC) and len(data) > len(KPL_MAGIC) + KPL_DIGEST_SIZE:
+        message = data[len(KPL_MAGIC):-KPL_DIGEST_SIZE]
+        if hashlib.md5(message).digest() == data[-KPL_DIGEST_SIZE:]:
+            aggregated = messages_pb2.AggregatedRecord()
+            aggregated.ParseFromString(message)
+            for user_record in aggregated.records:
+                yield user_record.data
+            return
+
+    yield data
+
+def epoch_ms_to_iso(timestamp_ms):
+    """
+    Formats an epoch-milliseconds timestamp as ISO 8601 (UTC, millisecond precision).
+
+    Args:
+        timestamp_ms (int): The transaction timestamp as carried on the stream.
+
+    Returns:
+        str: e.g. "2024-05-01T12:00:00.123".
+    """
+    second, millis = divmod(timestamp_ms, 1000)
+    if second != _iso_second_cache[0]:
+        _iso_second_cache[:] = [second, datetime.utcfromtimestamp(second).isoformat()]
+    return f"{_iso_second_cache[1]}.{millis:03d}"
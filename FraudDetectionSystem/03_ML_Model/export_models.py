@@ -0,0 +1,18 @@
+# export_models.py
+# Exports the trained (joblib-pickled) XGBoost models to XGBoost's UBJSON format.
+# The Lambdas load the .ubj files: they parse much faster than unpickling, which
+# cuts cold-start time, and they do not depend on the pickling library versions.
+#
+# Run from this directory after retraining:  python export_models.py
+
+import joblib
+
+MODELS = {
+    "champion/model_v1.joblib": "champion/model_v1.ubj",
+    "challenger/model_v2.joblib": "challenger/model_v2.ubj",
+}
+
+if __name__ == "__main__":
+    for joblib_path, ubj_path in MODELS.items():
+        joblib.load(joblib_path).save_model(ubj_path)
+        print(f"Exported {joblib_path} -> {ubj_path}")
@@ -1,53 +1,107 @@
 # lambda_shap.py
 # Asynchronous Lambda function to calculate SHAP values for fraud explainability.
 
-import json
-import joblib
-import shap
+import orjson
 import pandas as pd
+import xgboost as xgb
 import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
 # --- Environment & AWS Clients ---
 FRAUD_CASES_TABLE = os.environ.get("FRAUD_CASES_TABLE", "FraudCasesTable")
 EXPLAINABILITY_BUCKET = os.environ.get("EXPLAINABILITY_BUCKET", "your-unique-bucket-name-fraud-detection")
-CHAMPION_MODEL_PATH = "champion/model_v1.joblib" # Assumes model is deployed with Lambda
+CHAMPION_MODEL_PATH = "champion/model_v1.ubj" # Assumes model is deployed with Lambda (XGBoost UBJSON)
+FEATURE_NAMES = ['amount', 'latitude', 'longitude', 'hour_of_day', 'day_of_week']
+# S3 uploads and DynamoDB updates are I/O-bound, so they are issued concurrently
+MAX_IO_WORKERS = 32
 
-dynamodb = boto3.resource('dynamodb')
+# Low-level clients: unlike Table resources they are thread-safe
+dynamodb = boto3.client('dynamodb')
 s3 = boto3.client('s3')
-fraud_cases_table = dynamodb.Table(FRAUD_CASES_TABLE)
 
 # --- Model & Explainer Loading ---
-# Load the model and create a SHAP explainer outside the handler for reuse.
+# Load the model and its booster outside the handler for reuse.
 try:
     # We only explain decisions from the champion model for consistency
-    model = joblib.load(CHAMPION_MODEL_PATH)
-    # Use the TreeExplainer for XGBoost models
-    explainer = shap.TreeExplainer(model)
+    # Native XGBoost format: parses much faster than unpickling on cold start
+    model = xgb.XGBClassifier()
+    model.load_model(CHAMPION_MODEL_PATH)
+    # XGBoost computes exact TreeSHAP values natively (pred_contribs=True), in C++,
+    # which is much faster than the Python shap library for the same result.
+    explainer = model.get_booster()
     print("Successfully loaded model and SHAP explainer.")
 except Exception as e:
     print(f"FATAL: Could not load model or create explainer. {e}")
     model = None
     explainer = None
 
-def calculate_shap_values(features):
-    """Calculates SHAP values for a given set of features."""
+def calculate_shap_values(features_df):
+    """
+    Calculates SHAP values for a batch of feature rows in a single booster call.
+
+    Returns:
+        list: One explanation dict per row of features_df.
+    """
     if not explainer:
         raise ValueError("SHAP explainer not initialized.")
 
-    # Convert single prediction to a DataFrame
-    feature_names = ['amount', 'latitude', 'longitude', 'hour_of_day', 'day_of_week']
-    features_df = pd.DataFrame([features], columns=feature_names)
-
-    # Get SHAP values
-    shap_values = explainer.shap_values(features_df)
+    # Last column of the contributions matrix is the bias (the SHAP base value)
+    contributions = explainer.predict(xgb.DMatrix(features_df[FEATURE_NAMES]), pred_contribs=True)
 
     # Format the output for easy interpretation
-    explanation = {
-        "base_value": explainer.expected_value,
-        "shap_values": dict(zip(feature_names, shap_values[0].tolist()))
-    }
-    return explanation
+    return [
+        {
+            "base_value": float(row[-1]),
+            "shap_values": dict(zip(FEATURE_NAMES, row[:-1].tolist()))
+        }
+        for row in contributions
+    ]
+
+def prepare_features(transaction):
+    """Builds the model feature row for a transaction (same as in the main Lambda)."""
+    # The main Lambda attaches the engineered time features to the message;
+    # recalculate them consistently from the epoch timestamp if they are missing.
+    if 'hour_of_day' in transaction and 'day_of_week' in transaction:
+        hour = transaction['hour_of_day']
+        day = transaction['day_of_week']
+    else:
+        txn_time = datetime.utcfromtimestamp(transaction['timestamp'] / 1000) # Epoch in milliseconds
+        hour = txn_time.hour
+        day = txn_time.weekday()
+
+    return [transaction['amount'], transaction['latitude'], transaction['longitude'], hour, day]
+
+def store_report(report):
+    """Saves one explanation report to S3 and points its fraud case at it."""
+    case_id = report['caseId']
+    try:
+        # Save report to S3
+        s3_key = f"explainability-reports/{case_id}.json"
+        s3.put_object(
+            Bucket=EXPLAINABILITY_BUCKET,
+            Key=s3_key,
+            # orjson handles datetime and numpy values natively and writes bytes directly
+            Body=orjson.dumps(report, default=str, option=orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY)
+        )
+
+        # Update the DynamoDB case table with the location of the report
+        dynamodb.update_item(
+            TableName=FRAUD_CASES_TABLE,
+            Key={'caseId': {'S': case_id}},
+            UpdateExpression="SET shapReportS3Url = :url, #status = :stat",
+            # 'status' is a DynamoDB reserved word
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':url': {'S': f"s3://{EXPLAINABILITY_BUCKET}/{s3_key}"},
+                ':stat': {'S': "EXPLAINED"}
+            }
+        )
+        print(f"Successfully generated and stored SHAP report for {case_id}")
+
+    except Exception as e:
+        print(f"Error processing SHAP explanation for {case_id}: {e}")
 
 def lambda_handler(event, context):
     """
@@ -57,57 +111,41 @@ def lambda_handler(event, context):
         print("Model/Explainer not loaded. Aborting.")
         return {'statusCode': 500}
 
+    # 1. Prepare features for every message so SHAP runs once per invocation
+    transactions = []
+    feature_rows = []
     for record in event['Records']: # SQS messages arrive in a list
         try:
-            transaction = json.loads(record['body'])
-            transaction_id = transaction['transactionId']
-            case_id = f"case_{transaction_id}"
-            print(f"Generating SHAP explanation for case: {case_id}")
-
-            # 1. Prepare features for the model (same as in the main Lambda)
-            # In a real system, you'd pass these engineered features in the message
-            # or recalculate them consistently.
-            from datetime import datetime
-            txn_time = datetime.fromisoformat(transaction['timestamp'])
-            hour = txn_time.hour
-            day = txn_time.weekday()
-
-            model_features = [
-                transaction['amount'], transaction['latitude'], transaction['longitude'],
-                hour, day
-            ]
-
-            # 2. Calculate SHAP values
-            shap_explanation = calculate_shap_values(model_features)
-
-            # 3. Store the explanation report
-            report = {
-                "caseId": case_id,
-                "transactionDetails": transaction,
-                "shapExplanation": shap_explanation,
-                "reportGeneratedAt": datetime.utcnow().isoformat()
-            }
+            transaction = orjson.loads(record['body'])
+            feature_rows.append(prepare_features(transaction))
+            transactions.append(transaction)
+        except Exception as e:
+            print(f"Error parsing SQS message for SHAP explanation: {e}")
 
-            # Save report to S3
-            s3_key = f"explainability-reports/{case_id}.json"
-            s3.put_object(
-                Bucket=EXPLAINABILITY_BUCKET,
-                Key=s3_key,
-                Body=json.dumps(report, default=str)
-            )
-
-            # Update the DynamoDB case table with the location of the report
-            fraud_cases_table.update_item(
-                Key={'caseId': case_id},
-                UpdateExpression="SET shapReportS3Url = :url, status = :stat",
-                ExpressionAttributeValues={
-                    ':url': f"s3://{EXPLAINABILITY_BUCKET}/{s3_key}",
-                    ':stat': "EXPLAINED"
-                }
-            )
-            print(f"Successfully generated and stored SHAP report for {case_id}")
+    if not transactions:
+        return {'statusCode': 200}
 
-        except Exception as e:
-            print(f"Error processing SHAP explanation for a record: {e}")
+    # 2. Calculate SHAP values for the whole batch
+    try:
+        shap_explanations = calculate_shap_values(pd.DataFrame(feature_rows, columns=FEATURE_NAMES))
+    except Exception as e:
+        print(f"Error calculating SHAP values for {len(transactions)} records: {e}")
+        return {'statusCode': 500}
+
+    # 3. Build the explanation reports
+    generated_at = datetime.utcnow().isoformat()
+    reports = []
+    for transaction, shap_explanation in zip(transactions, shap_explanations):
+        case_id = f"case_{transaction['transactionId']}"
+        reports.append({
+            "caseId": case_id,
+            "transactionDetails": transaction,
+            "shapExplanation": shap_explanation,
+            "reportGeneratedAt": generated_at
+        })
+
+    # 4. Store every report concurrently
+    with ThreadPoolExecutor(max_workers=min(MAX_IO_WORKERS, len(reports))) as executor:
+        list(executor.map(store_report, reports))
 
     return {'statusCode': 200}